@@ -1,85 +1,331 @@
-import os, json, requests, datetime
+import os, re, json, time, sqlite3, asyncio, datetime
+from collections import defaultdict
+import httpx
+import orjson
 import gspread
 from google.oauth2.service_account import Credentials
+from sheet_io import a1, read_ranges, records_from_values
 
 OPENALEX = "https://api.openalex.org"
 
+# Sheet tabs (snapshot tab can be overridden per deployment)
+PROF_MASTER_SHEET = "0PROF_MASTER"
+DAILY_SNAPSHOT_SHEET = os.environ.get("DAILY_SNAPSHOT_SHEET") or "DAILY_SNAPSHOT"
+ACTIVITY_LOG_SHEET = "DAILY_ACTIVITY_LOG"
+
 # Strongly recommended by OpenAlex etiquette + helps reduce blocks
 OPENALEX_EMAIL = os.environ.get("OPENALEX_MAILTO", "")
 HEADERS = {
     "User-Agent": f"prof-activity-tracker/1.0 (mailto:{OPENALEX_EMAIL})" if OPENALEX_EMAIL else "prof-activity-tracker/1.0"
 }
 
-def safe_get_json(url, params=None):
+# Leading "https://openalex.org/" or "https://api.openalex.org/authors/" on pasted ids
+OPENALEX_ID_PREFIX = re.compile(r"^https?://(?:api\.)?openalex\.org/(?:authors/)?")
+# What a normalized author id must look like before it goes into a shared OR-filter
+OPENALEX_AUTHOR_ID = re.compile(r"^A\d+$")
+
+# Max OpenAlex requests in flight at once (keeps us polite + under rate limits)
+CONCURRENCY = 20
+
+# OpenAlex accepts up to 50 "|"-separated values in one filter
+BATCH_SIZE = 50
+
+# On-disk cache of OpenAlex lookups. Only helps same-day reruns on the same machine
+# (e.g. rerunning locally after a Sheets write failed); each Actions run starts empty
+CACHE_PATH = os.environ.get("OPENALEX_CACHE_PATH", ".cache/openalex.sqlite")
+# Well under the daily cron interval, so a (drifting) scheduled run never reuses
+# yesterday's answers; only same-day reruns hit the cache
+CACHE_TTL = 12 * 60 * 60  # seconds
+
+# DAILY_SNAPSHOT columns (the sheet is rewritten in this order every run)
+SNAPSHOT_HEADER = ["prof_id", "last_check", "total_works", "total_citations", "last_pub_date", "citations_checked"]
+# Fields we carry forward: (last_check, total_works, total_citations, last_pub_date, citations_checked)
+SNAPSHOT_DEFAULT = ("1900-01-01", "", 0, "", "")
+
+# Profs with no new works only get their citation count refreshed this often
+AUTHOR_REFRESH_DAYS = 7
+
+# Sheets rejects any cell over 50,000 characters; joined titles/links are cut below that
+MAX_CELL_CHARS = 45000
+
+# Rows per values.append request (keeps each payload well under Sheets' size limits)
+APPEND_CHUNK = 1000
+
+# Retry transient OpenAlex failures with exponential backoff (0.5s, 1s, 2s)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest Retry-After we'll honor; the sleep holds a semaphore slot
+MAX_RETRY_AFTER = 60  # seconds
+
+async def safe_get_json(client, url, params=None):
     """Fetch JSON safely. Returns dict or None."""
-    try:
-        r = requests.get(url, params=params, headers=HEADERS, timeout=30)
-    except requests.RequestException as e:
-        print(f"[WARN] Request error: {url} -> {e}")
-        return None
+    for attempt in range(MAX_RETRIES + 1):
+        delay = BACKOFF_FACTOR * (2 ** attempt)
+        try:
+            r = await client.get(url, params=params)
+            status = r.status_code
+            content = r.content
+            retry_after = r.headers.get("Retry-After", "")
+        except httpx.HTTPError as e:
+            if attempt < MAX_RETRIES:
+                await asyncio.sleep(delay)
+                continue
+            print(f"[WARN] Request error: {url} -> {e}")
+            return None
+
+        if status in RETRY_STATUSES and attempt < MAX_RETRIES:
+            # Honor the server's Retry-After when it gives us one
+            await asyncio.sleep(min(float(retry_after), MAX_RETRY_AFTER) if retry_after.isdigit() else delay)
+            continue
+        break
 
-    if r.status_code != 200:
+    if status != 200:
         # Print a short snippet to diagnose HTML/Cloudflare/etc.
-        snippet = (r.text or "")[:200].replace("\n", " ")
-        print(f"[WARN] Non-200 from OpenAlex: {r.status_code} url={url} params={params} body={snippet}")
+        snippet = content[:200].decode("utf-8", "replace").replace("\n", " ")
+        print(f"[WARN] Non-200 from OpenAlex: {status} url={url} params={params} body={snippet}")
         return None
 
     try:
-        return r.json()
+        # orjson parses the raw bytes directly and is much faster on big works pages
+        return orjson.loads(content)
     except Exception:
-        snippet = (r.text or "")[:200].replace("\n", " ")
+        snippet = content[:200].decode("utf-8", "replace").replace("\n", " ")
         print(f"[WARN] Non-JSON response from OpenAlex url={url} body={snippet}")
         return None
 
+def open_cache(path=CACHE_PATH):
+    """Open (or create) the sqlite response cache and drop expired entries."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cache = sqlite3.connect(path)
+    cache.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL, body TEXT)")
+    cache.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - CACHE_TTL,))
+    return cache
+
+def cache_get(cache, key):
+    """Return the cached JSON value for key, or None if missing/expired."""
+    row = cache.execute("SELECT stored_at, body FROM responses WHERE key = ?", (key,)).fetchone()
+    if not row or time.time() - row[0] > CACHE_TTL:
+        return None
+    return json.loads(row[1])
+
+def cache_put(cache, key, value):
+    cache.execute(
+        "INSERT OR REPLACE INTO responses (key, stored_at, body) VALUES (?, ?, ?)",
+        (key, time.time(), json.dumps(value)),
+    )
+
 def normalize_openalex_author_id(openalex_id_raw: str) -> str:
     """Accepts 'A123', 'https://openalex.org/A123' and returns 'A123'."""
     if not openalex_id_raw:
         return ""
-    s = openalex_id_raw.strip()
-    s = s.replace("https://openalex.org/", "").replace("http://openalex.org/", "")
-    # Some people paste full API URL too:
-    s = s.replace("https://api.openalex.org/authors/", "").replace("http://api.openalex.org/authors/", "")
-    return s
-
-def get_author(author_id):
-    if not author_id or not author_id.startswith("A"):
-        return None
-    url = f"{OPENALEX}/authors/{author_id}"
-    return safe_get_json(url)
+    # Also covers people pasting the full API URL
+    return OPENALEX_ID_PREFIX.sub("", openalex_id_raw.strip())
+
+async def get_all_pages(client, sem, url, params):
+    """Follow OpenAlex cursor pagination to the end. Returns (results, complete)."""
+    params = dict(params, per_page=200, cursor="*")
+    results = []
+    while params["cursor"]:
+        async with sem:
+            data = await safe_get_json(client, url, params=params)
+        if not data:
+            return results, False
+        results.extend(data.get("results", []))
+        params["cursor"] = (data.get("meta") or {}).get("next_cursor")
+    return results, True
+
+async def get_authors(client, sem, cache, author_ids):
+    """Fetch citation/work counts for a batch of authors.
+
+    Returns ({author_id: author}, cached_ids); cached_ids were served from the disk cache
+    rather than fetched just now.
+    """
+    author_ids = [a for a in author_ids if OPENALEX_AUTHOR_ID.match(a)]
+    authors = {}
+
+    to_fetch, cached_ids = [], []
+    for aid in author_ids:
+        cached = cache_get(cache, f"author:{aid}")
+        if cached is None:
+            to_fetch.append(aid)
+        else:
+            authors[aid] = cached
+            cached_ids.append(aid)
+    if not to_fetch:
+        return authors, cached_ids
+
+    url = f"{OPENALEX}/authors"
+    params = {
+        # One query per batch, and only the fields we actually read
+        "filter": f"openalex:{'|'.join(to_fetch)}",
+        "select": "id,display_name,cited_by_count,works_count"
+    }
+    results, _ = await get_all_pages(client, sem, url, params)
+
+    # Partial results are still fine here; missing authors just fall back to the snapshot
+    for a in results:
+        aid = normalize_openalex_author_id(a.get("id") or "")
+        if aid:
+            authors[aid] = a
+            cache_put(cache, f"author:{aid}", a)
+    return authors, cached_ids
 
-def get_new_works(author_id, since_date):
-    if not author_id or not author_id.startswith("A"):
-        return []
+async def get_new_works(client, sem, cache, author_ids, since_date):
+    """Fetch works since since_date for a batch of authors.
+
+    Returns ({author_id: [works]}, failed_ids); failed_ids lists the authors whose
+    query failed or stopped partway, so their results are incomplete.
+    """
+    author_ids = [a for a in author_ids if OPENALEX_AUTHOR_ID.match(a)]
+    works_by_author = defaultdict(list)
+
+    # Only query authors we don't already have cached for this since_date
+    to_fetch = []
+    for aid in author_ids:
+        cached = cache_get(cache, f"works:{aid}:{since_date}")
+        if cached is None:
+            to_fetch.append(aid)
+        else:
+            works_by_author[aid] = cached
+    if not to_fetch:
+        return works_by_author, []
+
+    wanted = set(to_fetch)
     url = f"{OPENALEX}/works"
     params = {
-        # IMPORTANT: correct filter for works by author
-        "filter": f"authorships.author.id:{author_id},from_publication_date:{since_date}",
-        "per_page": 200
+        # IMPORTANT: correct filter for works by author ("|" ORs the whole batch)
+        "filter": f"authorships.author.id:{'|'.join(to_fetch)},from_publication_date:{since_date}",
+        # Every page is held until the batch is done, so only pull what we use
+        "select": "id,doi,display_name,publication_date,authorships"
     }
-    data = safe_get_json(url, params=params)
-    if not data:
-        return []
-    return data.get("results", [])
+    results, complete = await get_all_pages(client, sem, url, params)
 
-def main():
-    creds_info = json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
-    scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
-    gc = gspread.authorize(creds)
+    # Map each work back to whichever batch authors are on it
+    unmatched = {}
+    for w in results:
+        # Keep just the fields we report on (also keeps the cache small)
+        slim = {k: w.get(k) for k in ("id", "doi", "display_name", "publication_date")}
+        if len(to_fetch) == 1:
+            # The filter alone ties every result to this author; list responses can
+            # truncate authorships on big collaborations, so don't depend on them
+            works_by_author[to_fetch[0]].append(slim)
+            continue
+        matched = set()
+        for a in w.get("authorships") or []:
+            aid = normalize_openalex_author_id((a.get("author") or {}).get("id") or "")
+            if aid in wanted and aid not in matched:
+                matched.add(aid)
+                works_by_author[aid].append(slim)
+        if not matched:
+            # (the prefix strip works for W ids too)
+            unmatched[normalize_openalex_author_id(slim.get("id") or "")] = slim
 
-    sh = gc.open_by_key(os.environ["SHEET_ID"])
-    prof_master = sh.worksheet("0PROF_MASTER")
-    snapshot_ws  = sh.worksheet("DAILY_SNAPSHOT")
-    log_ws       = sh.worksheet("DAILY_ACTIVITY_LOG")
+    if unmatched:
+        # Truncated authorships: the batch filter matched these works but we can't tell
+        # whose they are, so ask per author (the single-id filter itself is the attribution)
+        print(f"[INFO] Re-querying {len(unmatched)} works with truncated authorships per author (since={since_date})")
+        work_ids = sorted(unmatched)
+        requeries = [
+            (aid, work_ids[i:i + BATCH_SIZE]) for aid in to_fetch for i in range(0, len(work_ids), BATCH_SIZE)
+        ]
+        requery_results = await asyncio.gather(*[
+            get_all_pages(client, sem, url, {
+                "filter": f"authorships.author.id:{aid},openalex:{'|'.join(ids)}",
+                "select": "id"
+            })
+            for aid, ids in requeries
+        ])
+        for (aid, _), (hits, ok) in zip(requeries, requery_results):
+            complete = complete and ok
+            for h in hits:
+                work = unmatched.get(normalize_openalex_author_id(h.get("id") or ""))
+                if work:
+                    works_by_author[aid].append(work)
 
-    today = datetime.date.today().isoformat()
+    if not complete:
+        # Don't cache (or trust) a partial result set if a page failed midway
+        return works_by_author, to_fetch
+
+    for aid in to_fetch:
+        cache_put(cache, f"works:{aid}:{since_date}", works_by_author[aid])
+    return works_by_author, []
+
+def join_capped(parts):
+    """' | '-join the non-empty parts, truncated to fit in one sheet cell."""
+    text = " | ".join(p for p in parts if p)
+    if len(text) > MAX_CELL_CHARS:
+        text = text[:MAX_CELL_CHARS - 1] + "…"
+    return text
+
+def citations_fresh(citations_checked, today):
+    """True if total_citations was refreshed from OpenAlex less than AUTHOR_REFRESH_DAYS ago."""
+    try:
+        checked = datetime.date.fromisoformat(str(citations_checked))
+    except ValueError:
+        return False
+    return (datetime.date.fromisoformat(today) - checked).days < AUTHOR_REFRESH_DAYS
+
+def process_prof(pid, author_id, works, author, snapshot, today, works_ok=True, author_cached=False):
+    """Build rows for one prof. Returns (log_row or None, snapshot_row).
+
+    works_ok=False means the works lookup failed; last_check is then left where it was
+    so those days are queried again next run instead of being skipped for good.
+    author_cached=True means author came from the disk cache, so citations_checked isn't
+    bumped (the next run still does a live refresh).
+    A prof with no snapshot row (or a blank last_check) is being seeded: only the snapshot
+    row is written, since every work they've ever published would otherwise log as new.
+    """
+    prev_check, prev_works, prev_cites, last_pub_date, citations_checked = snapshot.get(pid, SNAPSHOT_DEFAULT)
+    last_check = today if works_ok else (prev_check or SNAPSHOT_DEFAULT[0])
+    seeding = pid not in snapshot or not prev_check
+    prev_cites = int(prev_cites or 0)
+    last_pub_date = last_pub_date or ""
+
+    new_pubs = len(works)
+    titles, links = [], []
 
-    profs = prof_master.get_all_records()
-    snapshot = {r["prof_id"]: r for r in snapshot_ws.get_all_records()}
+    for w in works:
+        titles.append(w.get("display_name", ""))
+        links.append(w.get("doi") or w.get("id") or "")
+        pub_date = w.get("publication_date")
+        if pub_date:
+            # ISO date strings compare safely lexicographically
+            last_pub_date = max(last_pub_date, pub_date)
 
-    log_rows = []
-    new_snapshot = []
+    if author:
+        works_count = author.get("works_count", "")
+        total_cites = int(author.get("cited_by_count", 0) or 0)
+        cite_delta = max(0, total_cites - prev_cites)
+        if not author_cached:
+            citations_checked = today
+    else:
+        # Skipped (no new works + citations still fresh) or the lookup failed: carry the
+        # previous counts forward (keeps pipeline moving). citations_checked stays old, so
+        # a failed lookup is retried next run; new works still get logged below.
+        works_count, total_cites, cite_delta = prev_works, prev_cites, 0
+
+    log_row = None
+    if seeding:
+        if not (works_ok and author):
+            # No complete baseline yet: leave last_check blank so the next run seeds again
+            last_check = ""
+    elif new_pubs > 0 or cite_delta > 0:
+        log_row = [
+            today,
+            pid,
+            new_pubs,
+            join_capped(titles),
+            join_capped(links),
+            cite_delta,
+            "OpenAlex"
+        ]
 
+    return log_row, [pid, last_check, works_count, total_cites, last_pub_date, citations_checked]
+
+def prof_targets(profs, snapshot):
+    """Returns [(prof_id, author_id, last_check)] for profs with an OpenAlex id (malformed ones warned about)."""
+    targets = []
     for p in profs:
         pid = p.get("prof_id", "")
         openalex_id_raw = (p.get("openalex_id") or "").strip()
@@ -89,54 +335,127 @@ def main():
         author_id = normalize_openalex_author_id(openalex_id_raw)
         if not author_id:
             continue
+        if not OPENALEX_AUTHOR_ID.match(author_id):
+            # Kept as a target (its snapshot row carries forward) but never sent to OpenAlex,
+            # where one bad id would break the shared batch query for everyone else
+            print(f"[WARN] Malformed OpenAlex id for {pid}: {openalex_id_raw!r}")
 
-        last_check = snapshot.get(pid, {}).get("last_check", "1900-01-01")
-        works = get_new_works(author_id, last_check)
-
-        new_pubs = len(works)
-        titles, links = [], []
-        last_pub_date = snapshot.get(pid, {}).get("last_pub_date", "") or ""
-
-        for w in works:
-            titles.append(w.get("display_name", ""))
-            links.append(w.get("doi") or w.get("id") or "")
-            pub_date = w.get("publication_date")
-            if pub_date:
-                # ISO date strings compare safely lexicographically
-                last_pub_date = max(last_pub_date, pub_date)
-
-        author = get_author(author_id)
-        if not author:
-            # Still write snapshot row with what we have (keeps pipeline moving)
-            prev_cites = int(snapshot.get(pid, {}).get("total_citations", 0) or 0)
-            new_snapshot.append([pid, today, "", prev_cites, last_pub_date])
-            continue
+        last_check = snapshot.get(pid, SNAPSHOT_DEFAULT)[0] or SNAPSHOT_DEFAULT[0]
+        targets.append((pid, author_id, last_check))
+    return targets
 
-        total_cites = int(author.get("cited_by_count", 0) or 0)
-        prev_cites = int(snapshot.get(pid, {}).get("total_citations", 0) or 0)
-        cite_delta = max(0, total_cites - prev_cites)
+async def fetch_openalex(targets, snapshot, today):
+    """Batched OpenAlex lookups over one shared HTTP/2 client.
+
+    Authors are only looked up for profs with new works or a stale citation count.
+    Returns ({(author_id, since_date): [works]}, {author_id: author}, failed_works, cached_authors)
+    where failed_works is the set of (author_id, since_date) whose works query failed and
+    cached_authors the author ids served from the disk cache.
+    """
+    # Authors sharing a last_check can share one batched works query
+    buckets = defaultdict(set)
+    for _, author_id, last_check in targets:
+        if OPENALEX_AUTHOR_ID.match(author_id):
+            buckets[last_check].add(author_id)
+    works_batches = []
+    for since_date, ids in buckets.items():
+        ids = sorted(ids)
+        for i in range(0, len(ids), BATCH_SIZE):
+            works_batches.append((since_date, ids[i:i + BATCH_SIZE]))
+
+    sem = asyncio.Semaphore(CONCURRENCY)
+    # HTTP/2 lets many in-flight requests share one connection to api.openalex.org
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+    cache = open_cache()
+    try:
+        async with httpx.AsyncClient(http2=True, headers=HEADERS, limits=limits, timeout=30) as client:
+            works_results = await asyncio.gather(*[
+                get_new_works(client, sem, cache, ids, since_date) for since_date, ids in works_batches
+            ])
+
+            works_lookup = {}
+            failed_works = set()
+            for (since_date, _), (works_by_author, failed_ids) in zip(works_batches, works_results):
+                for author_id in failed_ids:
+                    failed_works.add((author_id, since_date))
+                for author_id, works in works_by_author.items():
+                    if (author_id, since_date) not in failed_works:
+                        works_lookup[(author_id, since_date)] = works
 
-        if new_pubs > 0 or cite_delta > 0:
-            log_rows.append([
-                today,
-                pid,
-                new_pubs,
-                " | ".join([t for t in titles if t]),
-                " | ".join([l for l in links if l]),
-                cite_delta,
-                "OpenAlex"
+            # Most days most profs have nothing new; only refresh citations when there is
+            # activity or the last refresh is AUTHOR_REFRESH_DAYS old
+            refresh_ids = sorted({
+                author_id for pid, author_id, last_check in targets
+                if works_lookup.get((author_id, last_check))
+                or not citations_fresh(snapshot.get(pid, SNAPSHOT_DEFAULT)[4], today)
+            })
+            author_batches = [refresh_ids[i:i + BATCH_SIZE] for i in range(0, len(refresh_ids), BATCH_SIZE)]
+            author_results = await asyncio.gather(*[
+                get_authors(client, sem, cache, ids) for ids in author_batches
             ])
+    finally:
+        cache.commit()
+        cache.close()
+
+    authors, cached_authors = {}, set()
+    for batch, cached_ids in author_results:
+        authors.update(batch)
+        cached_authors.update(cached_ids)
+    return works_lookup, authors, failed_works, cached_authors
+
+def append_rows_chunked(ws, rows, value_input_option, insert_data_option="INSERT_ROWS"):
+    """append_rows() in APPEND_CHUNK-sized batches, always appended to the table at A1."""
+    # Sequential on purpose: parallel appends to one table can interleave rows.
+    for i in range(0, len(rows), APPEND_CHUNK):
+        ws.append_rows(
+            rows[i:i + APPEND_CHUNK],
+            value_input_option=value_input_option,
+            insert_data_option=insert_data_option,
+            table_range="A1",
+        )
+
+def main():
+    creds_info = json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
+    scopes = ["https://www.googleapis.com/auth/spreadsheets"]
+    creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
+    gc = gspread.authorize(creds)
+
+    sh = gc.open_by_key(os.environ["SHEET_ID"])
+    snapshot_ws  = sh.worksheet(DAILY_SNAPSHOT_SHEET)
+    log_ws       = sh.worksheet(ACTIVITY_LOG_SHEET)
+
+    today = datetime.date.today().isoformat()
+
+    # Both reads in a single batchGet round trip
+    prof_values, snapshot_values = read_ranges(sh, [a1(PROF_MASTER_SHEET), a1(DAILY_SNAPSHOT_SHEET)])
+    profs = records_from_values(prof_values)
+    # prof_id -> SNAPSHOT_DEFAULT-shaped tuple; rows padded so short (or older 5-column) ones index safely
+    snapshot = {r[0]: tuple(r[1:6]) for r in (row + [""] * 6 for row in snapshot_values[1:])}
+
+    targets = prof_targets(profs, snapshot)
+    works_lookup, authors, failed_works, cached_authors = asyncio.run(fetch_openalex(targets, snapshot, today))
+
+    results = [
+        process_prof(
+            pid, author_id, works_lookup.get((author_id, last_check), []), authors.get(author_id), snapshot, today,
+            works_ok=(author_id, last_check) not in failed_works,
+            author_cached=author_id in cached_authors,
+        )
+        for pid, author_id, last_check in targets
+    ]
 
-        new_snapshot.append([pid, today, author.get("works_count", ""), total_cites, last_pub_date])
+    log_rows = [log_row for log_row, _ in results if log_row]
+    new_snapshot = [snap_row for _, snap_row in results]
 
     if log_rows:
-        log_ws.append_rows(log_rows, value_input_option="USER_ENTERED")
+        append_rows_chunked(log_ws, log_rows, value_input_option="USER_ENTERED")
 
     # Keep your existing behavior
     snapshot_ws.clear()
-    snapshot_ws.append_row(["prof_id","last_check","total_works","total_citations","last_pub_date"])
+    snapshot_ws.append_row(SNAPSHOT_HEADER)
     if new_snapshot:
-        snapshot_ws.append_rows(new_snapshot, value_input_option="USER_ENTERED")
+        # OVERWRITE: the sheet was just cleared, so refill its rows instead of growing the grid daily
+        append_rows_chunked(snapshot_ws, new_snapshot, value_input_option="USER_ENTERED", insert_data_option="OVERWRITE")
 
 if __name__ == "__main__":
     main()
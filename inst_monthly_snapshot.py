@@ -2,6 +2,9 @@ import os, json, datetime
 import gspread
 from google.oauth2.service_account import Credentials
 
+# Rows per values.append request (keeps each payload well under Sheets' size limits)
+APPEND_CHUNK = 1000
+
 def main():
     # --- Auth ---
     creds_info = json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
@@ -61,9 +64,14 @@ def main():
             "last_pub_date",
         ]])
 
-    # --- Append snapshot ---
-    if out:
-        ws_snapshot.append_rows(out, value_input_option="USER_ENTERED")
+    # --- Append snapshot (APPEND_CHUNK rows per request) ---
+    for i in range(0, len(out), APPEND_CHUNK):
+        ws_snapshot.append_rows(
+            out[i:i + APPEND_CHUNK],
+            value_input_option="USER_ENTERED",
+            insert_data_option="INSERT_ROWS",
+            table_range="A1",
+        )
 
 if __name__ == "__main__":
     main()
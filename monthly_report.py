@@ -1,6 +1,7 @@
-import os, json, datetime
+import os, re, json, datetime
 import gspread
 from google.oauth2.service_account import Credentials
+from sheet_io import a1, read_ranges, records_from_values
 from collections import Counter, defaultdict
 
 # ------------ CONFIG ------------
@@ -18,8 +19,12 @@ COL_DAYS = "days_since_last_pub"
 VALID_COUNTRIES = {"Singapore", "Malaysia"}
 VALID_STATUSES = ["HIGHLY ACTIVE", "ACTIVE", "STABLE", "DORMANT", "STAGNANT"]
 
+# Machines cells mix ";" and "," as separators; split on either (and eat surrounding spaces)
+MACHINE_SPLIT = re.compile(r"\s*[;,]\s*")
+
 def now_utc_iso():
-    return datetime.datetime.utcnow().replace(microsecond=0).isoformat()
+    # utcnow() is deprecated; drop tzinfo to keep the existing created_at_utc text format
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0, tzinfo=None).isoformat()
 
 def month_str(today=None):
     if today is None:
@@ -32,6 +37,17 @@ def load_gspread():
     creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
     return gspread.authorize(creds)
 
+def grid_sizes(sh, titles):
+    """{sheet title: (sheetId, rowCount)} for the given titles, from a single metadata fetch."""
+    meta = sh.fetch_sheet_metadata(params={"fields": "sheets.properties(sheetId,title,gridProperties.rowCount)"})
+    props = [ws["properties"] for ws in meta.get("sheets", [])]
+    # Only grid sheets have gridProperties (charts/object sheets don't); we only write to grid sheets
+    return {
+        p["title"]: (p["sheetId"], p["gridProperties"]["rowCount"])
+        for p in props
+        if p.get("title") in titles and "gridProperties" in p
+    }
+
 def safe_int(x, default=999999):
     try:
         return int(x)
@@ -39,21 +55,25 @@ def safe_int(x, default=999999):
         return default
 
 def normalize(s):
-    return (s or "").strip()
+    # Unformatted reads can hand back numbers, not just strings
+    return str(s).strip() if s not in (None, "") else ""
 
 def main():
     # --- Connect ---
     gc = load_gspread()
     sh = gc.open_by_key(os.environ["SHEET_ID"])
 
-    prof_ws = sh.worksheet(PROF_SHEET)
-    snap_ws = sh.worksheet(MONTHLY_SNAPSHOT_SHEET)
-    exec_ws = sh.worksheet(EXEC_SUMMARY_SHEET)
-
+    # Formatted once per run and shared by every row written
     month = month_str()
+    created_at = now_utc_iso()
 
-    # --- Read PROF_MASTER ---
-    profs = prof_ws.get_all_records()  # <-- THIS defines "profs"
+    # --- Read PROF_MASTER (+ column A of the output sheets, to find where to append) ---
+    prof_values, snap_col, exec_col = read_ranges(sh, [
+        a1(PROF_SHEET),
+        a1(MONTHLY_SNAPSHOT_SHEET, "A:A"),
+        a1(EXEC_SUMMARY_SHEET, "A:A"),
+    ])
+    profs = records_from_values(prof_values)  # <-- THIS defines "profs"
 
     # --- Group rows by country (skip junk/header rows) ---
     by_country = defaultdict(list)
@@ -76,45 +96,40 @@ def main():
     for country, rows in by_country.items():
         total = len(rows)
 
-        # Status counts (only count valid statuses, ignore blanks)
+        # Single pass over the rows: normalize each field once and feed every counter
         status_counts = Counter()
+        uni_counts = Counter()
+        machine_counter = Counter()
+        top_targets = 0
         for r in rows:
             st = normalize(r.get(COL_STATUS))
+            uni = normalize(r.get(COL_UNIVERSITY))
+            machines = normalize(r.get(COL_MACHINES))
+
+            # Status counts (only count valid statuses, ignore blanks)
             if st in VALID_STATUSES:
                 status_counts[st] += 1
 
+            # Top targets: (HIGHLY ACTIVE or ACTIVE) + days_since_last_pub <= 90
+            if st in ("HIGHLY ACTIVE", "ACTIVE") and safe_int(r.get(COL_DAYS)) <= 90:
+                top_targets += 1
+
+            # Top universities (by count)
+            if uni:
+                uni_counts[uni] += 1
+
+            # Top machine signals (split on ";" or ",")
+            if machines:
+                machine_counter.update(x for x in MACHINE_SPLIT.split(machines) if x)
+
         ha = status_counts.get("HIGHLY ACTIVE", 0)
         a = status_counts.get("ACTIVE", 0)
         s = status_counts.get("STABLE", 0)
         d = status_counts.get("DORMANT", 0)
         stg = status_counts.get("STAGNANT", 0)
 
-        # Top targets: (HIGHLY ACTIVE or ACTIVE) + days_since_last_pub <= 90
-        top_targets = 0
-        for r in rows:
-            st = normalize(r.get(COL_STATUS))
-            days = safe_int(r.get(COL_DAYS))
-            if st in ("HIGHLY ACTIVE", "ACTIVE") and days <= 90:
-                top_targets += 1
-
-        # Top universities (by count)
-        uni_counts = Counter()
-        for r in rows:
-            uni = normalize(r.get(COL_UNIVERSITY))
-            if uni:
-                uni_counts[uni] += 1
         top_unis_text = " | ".join([u for u, _ in uni_counts.most_common(5)])
 
-        # Top machine signals (split by ";" first, then "," fallback)
-        machine_counter = Counter()
-        for r in rows:
-            machines = normalize(r.get(COL_MACHINES))
-            if not machines:
-                continue
-            # your Machines strings often contain ";" and ","
-            parts = [x.strip() for x in machines.replace(";", ",").split(",") if x.strip()]
-            machine_counter.update(parts)
-
         top_machines_text = " | ".join([m for m, _ in machine_counter.most_common(8)])
 
         summary = (
@@ -142,14 +157,35 @@ def main():
         ])
 
         # EXEC_SUMMARY columns: month, summary_text, created_at_utc
-        exec_rows.append([month, summary, now_utc_iso()])
+        exec_rows.append([month, summary, created_at])
 
     # --- Write outputs (append history) ---
-    if snapshot_rows:
-        snap_ws.append_rows(snapshot_rows, value_input_option="USER_ENTERED")
-
-    if exec_rows:
-        exec_ws.append_rows(exec_rows, value_input_option="USER_ENTERED")
+    # Both sheets in one values.batchUpdate, each starting on the row after its last filled one
+    writes = [
+        (MONTHLY_SNAPSHOT_SHEET, len(snap_col) + 1, snapshot_rows),
+        (EXEC_SUMMARY_SHEET, len(exec_col) + 1, exec_rows),
+    ]
+    writes = [(title, start, rows) for title, start, rows in writes if rows]
+
+    if writes:
+        # values.update won't grow the grid like append does, so add any missing rows first
+        sizes = grid_sizes(sh, {title for title, _, _ in writes})
+        grow = []
+        for title, start, rows in writes:
+            sheet_id, row_count = sizes[title]
+            missing = start + len(rows) - 1 - row_count
+            if missing > 0:
+                grow.append({"appendDimension": {"sheetId": sheet_id, "dimension": "ROWS", "length": missing}})
+        if grow:
+            sh.batch_update({"requests": grow})
+
+        sh.values_batch_update({
+            "valueInputOption": "USER_ENTERED",
+            "data": [
+                {"range": a1(title, f"A{start}"), "majorDimension": "ROWS", "values": rows}
+                for title, start, rows in writes
+            ],
+        })
 
     print(f"[OK] Monthly report written for {month}. Countries: {list(by_country.keys())}")
 
@@ -0,0 +1,19 @@
+"""Sheet-reading helpers shared by the scripts in this repo (run from the repo root)."""
+
+def a1(title, cells=""):
+    """A1 range for a sheet title (quoted, so names like '0PROF_MASTER' work)."""
+    return f"'{title}'!{cells}" if cells else f"'{title}'"
+
+def read_ranges(sh, ranges):
+    """Read several A1 ranges in one values.batchGet call. Returns one row-list per range."""
+    # Raw numbers instead of display strings; dates stay as their displayed text (not serials)
+    params = {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"}
+    resp = sh.values_batch_get(ranges, params=params)
+    return [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+
+def records_from_values(values):
+    """Same shape as get_all_records(): header row -> list of dicts, short rows padded with ''."""
+    if not values:
+        return []
+    header, rows = values[0], values[1:]
+    return [dict(zip(header, row + [""] * (len(header) - len(row)))) for row in rows]